@@ -6,6 +6,8 @@ Run: streamlit run health_history_app.py
 
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
 import plotly.express as px
 import plotly.graph_objects as go
 from health_history_db import HealthHistoryDB
@@ -18,6 +20,58 @@ def init_db():
 
 db = init_db()
 
+@st.cache_data(show_spinner=False)
+def load_patient_bundle(patient_id):
+    """Query everything the page needs for a patient once (cached per patient)"""
+    return {
+        "summary": db.generate_health_summary(patient_id),
+        "meds": db.get_patient_medications(patient_id),
+        "labs": db.get_patient_labs(patient_id),
+        "abnormal": db.get_abnormal_labs(patient_id),
+        "timeline": db.get_health_timeline(patient_id)
+    }
+
+@st.cache_data(show_spinner=False)
+def lab_history_table(patient_id, show_all):
+    """Build the lab history display table as an Arrow table (cached per patient/filter)"""
+    bundle = load_patient_bundle(patient_id)
+    df = bundle["labs"] if show_all else bundle["abnormal"]
+    
+    display_cols = ["date", "test_name", "value", "unit", "status"]
+    display_table = df[display_cols].copy()
+    display_table["date"] = display_table["date"].dt.strftime("%Y-%m-%d")
+    display_table.columns = ["Date", "Test Name", "Value", "Unit", "Status"]
+    return pa.Table.from_pandas(display_table, preserve_index=False)
+
+# Trend charts with more points than this are downsampled before plotting
+MAX_TREND_POINTS = 500
+
+def lttb_indices(x, y, n_out):
+    """Pick n_out visually representative points (Largest-Triangle-Three-Buckets)"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    
+    # First and last points are always kept; the rest are split into buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    out = np.empty(n_out, dtype=int)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            avg_x = x[hi:edges[i + 2]].mean()
+            avg_y = y[hi:edges[i + 2]].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        # Keep the point forming the largest triangle with the previous pick and next bucket's mean
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
 # Page config
 st.set_page_config(page_title="Health History", layout="wide")
 st.title("📋 Patient Health History & Insights")
@@ -32,7 +86,8 @@ patient_id = patient_options[selected]
 
 # Get patient data
 patient_info = db.get_patient_info(patient_id)
-summary = db.generate_health_summary(patient_id)
+bundle = load_patient_bundle(patient_id)
+summary = bundle["summary"]
 
 st.divider()
 
@@ -83,17 +138,19 @@ st.divider()
 # ======================
 st.header("💊 Current Medications")
 
-meds_df = db.get_patient_medications(patient_id)
+meds_df = bundle["meds"]
 
 if not meds_df.empty:
     # Display medications in expandable sections
     for idx, row in meds_df.iterrows():
         with st.expander(f"**{row['medication_name']}** - {row['dosage']}"):
-            st.write(f"**Purpose:** {row['purpose']}")
-            st.write(f"**Frequency:** {row['frequency']}")
-            st.write(f"**Started:** {row['start_date'].strftime('%Y-%m-%d')}")
-            st.write(f"**Common Side Effects:** {row['side_effects']}")
-            st.write(f"**Monitoring Required:** {row['monitoring']}")
+            st.markdown("\n\n".join([
+                f"**Purpose:** {row['purpose']}",
+                f"**Frequency:** {row['frequency']}",
+                f"**Started:** {row['start_date'].strftime('%Y-%m-%d')}",
+                f"**Common Side Effects:** {row['side_effects']}",
+                f"**Monitoring Required:** {row['monitoring']}"
+            ]))
     
     # Medication adherence tips
     st.info("💡 **Medication Adherence Tips**: Take medications at the same time daily, use a pill organizer, set phone reminders, and never stop without consulting your doctor.")
@@ -107,7 +164,7 @@ st.divider()
 # ======================
 st.header("🧪 Lab Results History")
 
-labs_df = db.get_patient_labs(patient_id)
+labs_df = bundle["labs"]
 
 if not labs_df.empty:
     # Filter options
@@ -118,14 +175,8 @@ if not labs_df.empty:
         if not show_all:
             st.write("Showing abnormal only")
     
-    # Filter data
-    display_df = labs_df if show_all else db.get_abnormal_labs(patient_id)
-    
-    # Display lab results table
-    display_cols = ["date", "test_name", "value", "unit", "status"]
-    display_table = display_df[display_cols].copy()
-    display_table["date"] = display_table["date"].dt.strftime("%Y-%m-%d")
-    display_table.columns = ["Date", "Test Name", "Value", "Unit", "Status"]
+    # Display lab results table (filtered and converted to Arrow once per patient)
+    display_table = lab_history_table(patient_id, show_all)
     
     st.dataframe(display_table, use_container_width=True, height=400)
     
@@ -143,12 +194,19 @@ if not labs_df.empty:
             # Get reference range
             range_key = next((k for k in db.ranges if k.lower() == selected_test), None)
             
+            # Downsample long series so only representative points reach the browser
+            plot_data = trend_data
+            if len(plot_data) > MAX_TREND_POINTS:
+                plot_data = plot_data.dropna(subset=["value"])
+                keep = lttb_indices(plot_data["date"].astype("int64"), plot_data["value"], MAX_TREND_POINTS)
+                plot_data = plot_data.iloc[keep]
+            
             fig = go.Figure()
             
             # Add actual values line
-            fig.add_trace(go.Scatter(
-                x=trend_data["date"],
-                y=trend_data["value"],
+            fig.add_trace(go.Scattergl(
+                x=plot_data["date"],
+                y=plot_data["value"],
                 mode='lines+markers',
                 name='Actual Value',
                 line=dict(color='blue', width=2),
@@ -199,20 +257,21 @@ st.divider()
 # ======================
 st.header("📅 Health Timeline")
 
-timeline = db.get_health_timeline(patient_id)
+timeline = bundle["timeline"]
 
 if timeline:
-    # Display timeline
+    # Display timeline as a single markdown block
+    lines = []
     for event in timeline[:20]:  # Show last 20 events
         date_str = event["date"].strftime("%Y-%m-%d")
         
         if event["type"] == "Lab Test":
-            if "HIGH" in event["status"] or "LOW" in event["status"]:
-                st.error(f"**{date_str}** - {event['type']}: {event['description']} - {event['status']}")
-            else:
-                st.success(f"**{date_str}** - {event['type']}: {event['description']} - {event['status']}")
+            icon = "🔴" if "HIGH" in event["status"] or "LOW" in event["status"] else "🟢"
+            lines.append(f"{icon} **{date_str}** - {event['type']}: {event['description']} - {event['status']}")
         else:
-            st.info(f"**{date_str}** - {event['type']}: {event['description']}")
+            lines.append(f"🔵 **{date_str}** - {event['type']}: {event['description']}")
+    
+    st.markdown("\n\n".join(lines))
     
     if len(timeline) > 20:
         st.caption(f"Showing 20 of {len(timeline)} total events")
@@ -242,23 +301,21 @@ with st.expander("📥 View/Download Comprehensive Report"):
     ## Current Medications ({summary['total_medications']})
     """)
     
-    for med in summary['active_medications']:
-        st.markdown(f"- {med}")
+    if summary['active_medications']:
+        st.markdown("\n".join(f"- {med}" for med in summary['active_medications']))
     
     st.markdown(f"""
     ## Risk Factors & Alerts
     """)
     
-    for risk in summary['risk_factors']:
-        st.markdown(f"- {risk}")
+    st.markdown("\n".join(f"- {risk}" for risk in summary['risk_factors']))
     
     st.markdown(f"""
     ## Abnormal Test Results ({summary['abnormal_lab_count']})
     """)
     
     if summary['abnormal_tests']:
-        for test in summary['abnormal_tests']:
-            st.markdown(f"- {test.upper()}")
+        st.markdown("\n".join(f"- {test.upper()}" for test in summary['abnormal_tests']))
     else:
         st.markdown("- No abnormal results")
     
@@ -4,10 +4,49 @@ Provides functions to query and organize patient health history data
 """
 
 import pandas as pd
+import numpy as np
 import json
 from datetime import datetime
+from functools import lru_cache
 from typing import Dict, List, Optional
 
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional; fall back to plain numpy
+    njit = None
+
+# Lab status codes, indexed by the int8 codes produced by _classify
+STATUS_LABELS = np.array(["NORMAL ✓", "LOW ⬇️", "HIGH ⬆️", "UNKNOWN"])
+
+# Risk factor messages and the abnormal test name patterns that raise them
+RISK_PATTERNS = {
+    "Elevated cholesterol - cardiovascular risk": r"cholesterol|ldl",
+    "Blood sugar abnormality - diabetes risk": r"glucose|a1c",
+    "Blood pressure concerns": r"blood pressure|bp",
+    "Liver function monitoring needed": r"liver|alt|ast",
+    "Kidney function monitoring needed": r"kidney|creatinine",
+}
+
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _classify(v, lo, hi, out):
+        """Write a status code for each value against its low/high bounds"""
+        for i in prange(v.size):
+            if np.isnan(v[i]) or np.isnan(lo[i]) or np.isnan(hi[i]):
+                out[i] = 3
+            elif v[i] < lo[i]:
+                out[i] = 1
+            elif v[i] > hi[i]:
+                out[i] = 2
+            else:
+                out[i] = 0
+else:
+    def _classify(v, lo, hi, out):
+        """Write a status code for each value against its low/high bounds"""
+        known = ~(np.isnan(v) | np.isnan(lo) | np.isnan(hi))
+        out[:] = np.select([known & (v < lo), known & (v > hi), known], [1, 2, 0], default=3)
+
 
 class HealthHistoryDB:
     """Database class for managing patient health history"""
@@ -30,18 +69,69 @@ class HealthHistoryDB:
         with open(ranges_file) as f:
             self.ranges = json.load(f)
         
-        # Load CSV files
-        self.labs = pd.read_csv(labs_file)
-        self.meds = pd.read_csv(meds_file)
+        # Load CSV files (pyarrow reader parses dates while loading)
+        self.labs = pd.read_csv(labs_file, engine="pyarrow",
+                                dtype={"patient_id": "string", "test_name": "string", "unit": "string"},
+                                parse_dates=["test_date"])
+        self.meds = pd.read_csv(meds_file, engine="pyarrow",
+                                dtype={"patient_id": "string", "medication_name": "string"},
+                                parse_dates=["start_date"])
         
         # Clean up lab data
         self.labs.rename(columns={"test_date": "date", "test_value": "value"}, inplace=True)
         self.labs["test_name"] = self.labs["test_name"].str.strip().str.lower()
         self.labs["value"] = pd.to_numeric(self.labs["value"], errors="coerce")
-        self.labs["date"] = pd.to_datetime(self.labs["date"])
         
-        # Clean up medication data
-        self.meds["start_date"] = pd.to_datetime(self.meds["start_date"])
+        # Classify every lab result once against its reference range
+        self._ranges_lower = {k.lower(): v for k, v in self.ranges.items()}
+        self.labs["_low"] = self.labs["test_name"].map(
+            lambda t: self._ranges_lower.get(t, {}).get("low", np.nan))
+        self.labs["_high"] = self.labs["test_name"].map(
+            lambda t: self._ranges_lower.get(t, {}).get("high", np.nan))
+        codes = np.empty(len(self.labs), dtype=np.int8)
+        _classify(self.labs["value"].to_numpy(dtype=np.float64),
+                  self.labs["_low"].to_numpy(dtype=np.float64),
+                  self.labs["_high"].to_numpy(dtype=np.float64),
+                  codes)
+        self.labs["status_code"] = codes
+        self.labs["status"] = pd.Categorical.from_codes(codes, categories=STATUS_LABELS)
+        
+        # Categorical keys compare and group on integer codes
+        self.labs["patient_id"] = self.labs["patient_id"].astype("category")
+        self.labs["test_name"] = self.labs["test_name"].astype("category")
+        self.meds["patient_id"] = self.meds["patient_id"].astype("category")
+        self.meds["medication_name"] = self.meds["medication_name"].astype("category")
+        
+        # Index by patient (and test) once so lookups don't rescan the whole table;
+        # _row keeps file order for results sharing a date
+        self.labs["_row"] = np.arange(len(self.labs))
+        self.labs.sort_values(["patient_id", "test_name", "date"], inplace=True)
+        self.labs.set_index(["patient_id", "test_name"], inplace=True)
+        self.meds.sort_values(["patient_id", "start_date"], inplace=True)
+        self.meds.set_index("patient_id", inplace=True)
+        self._lab_columns = [c for c in self.labs.columns
+                             if not c.startswith("_") and c != "status_code"]
+        self._patient_lab_groups = dict(list(self.labs.groupby(level=0, observed=True)))
+        self._patient_med_groups = dict(list(self.meds.groupby(level=0, observed=True)))
+        
+        # Flatten medication details into a frame for merging
+        self._med_df = pd.DataFrame(
+            [{"medication_name": name,
+              "purpose_db": details.get("purpose"),
+              "side_effects": ", ".join(details.get("common_side_effects", [])),
+              "monitoring": ", ".join(details.get("monitoring_required", []))}
+             for name, details in self.med_db.items()],
+            columns=["medication_name", "purpose_db", "side_effects", "monitoring"]
+        )
+        
+        # Flag every risk factor for every patient from their abnormal labs
+        abnormal = self.labs[self.labs["status_code"].isin([1, 2])]
+        abnormal = abnormal.reset_index(level="test_name")["test_name"]
+        risk_hits = pd.DataFrame(
+            {risk: abnormal.str.contains(pattern, regex=True, na=False) for risk, pattern in RISK_PATTERNS.items()},
+            index=abnormal.index
+        )
+        self._risk_matrix = risk_hits.groupby(level=0, observed=True).any()
     
     def get_patient_info(self, patient_id: str) -> Dict:
         """Get basic patient information"""
@@ -49,57 +139,30 @@ class HealthHistoryDB:
     
     def get_patient_medications(self, patient_id: str) -> pd.DataFrame:
         """Get all medications for a patient"""
-        patient_meds = self.meds[self.meds["patient_id"] == patient_id].copy()
+        patient_meds = self._patient_med_groups.get(patient_id)
+        if patient_meds is None or patient_meds.empty:
+            return pd.DataFrame()
         
         # Add medication details from database
-        med_details = []
-        for _, row in patient_meds.iterrows():
-            med_name = row["medication_name"]
-            details = self.med_db.get(med_name, {})
-            
-            med_details.append({
-                "medication_name": med_name,
-                "dosage": row["dose"],  # Changed from "dosage" to "dose"
-                "frequency": row["frequency"],
-                "start_date": row["start_date"],
-                "reason": row["reason"],  # Changed from "purpose" to "reason"
-                "purpose": details.get("purpose", row["reason"]),  # Get from DB or use reason
-                "side_effects": ", ".join(details.get("common_side_effects", [])),
-                "monitoring": ", ".join(details.get("monitoring_required", []))
-            })
+        med_details = patient_meds.merge(self._med_df, on="medication_name", how="left")
+        med_details = med_details.rename(columns={"dose": "dosage"})
+        med_details["purpose"] = med_details["purpose_db"].fillna(med_details["reason"])
+        med_details[["side_effects", "monitoring"]] = med_details[["side_effects", "monitoring"]].fillna("")
         
-        return pd.DataFrame(med_details).sort_values("start_date", ascending=False) if med_details else pd.DataFrame()
+        columns = ["medication_name", "dosage", "frequency", "start_date", "reason",
+                   "purpose", "side_effects", "monitoring"]
+        return med_details[columns].sort_values("start_date", ascending=False)
     
     def get_patient_labs(self, patient_id: str) -> pd.DataFrame:
         """Get all lab results for a patient"""
-        patient_labs = self.labs[self.labs["patient_id"] == patient_id].copy()
-        
-        # Add status (normal/high/low) to each lab result
-        statuses = []
-        for _, row in patient_labs.iterrows():
-            test_name = row["test_name"]
-            value = row["value"]
-            
-            # Find matching range
-            range_key = next((k for k in self.ranges if k.lower() == test_name), None)
-            
-            if range_key and not pd.isna(value):
-                low = self.ranges[range_key]["low"]
-                high = self.ranges[range_key]["high"]
-                
-                if value < low:
-                    status = "LOW ⬇️"
-                elif value > high:
-                    status = "HIGH ⬆️"
-                else:
-                    status = "NORMAL ✓"
-            else:
-                status = "UNKNOWN"
-            
-            statuses.append(status)
-        
-        patient_labs["status"] = statuses
-        return patient_labs.sort_values("date", ascending=False)
+        return self._cached_patient_labs(patient_id).copy()
+    
+    @lru_cache(maxsize=64)
+    def _cached_patient_labs(self, patient_id: str) -> pd.DataFrame:
+        """Slice and sort a patient's labs (status is precomputed at load)"""
+        patient_labs = self._patient_lab_groups.get(patient_id, self.labs.iloc[:0])
+        patient_labs = patient_labs.sort_values(["date", "_row"], ascending=[False, True])
+        return patient_labs[self._lab_columns].reset_index()
     
     def get_abnormal_labs(self, patient_id: str) -> pd.DataFrame:
         """Get only abnormal lab results"""
@@ -136,9 +199,12 @@ class HealthHistoryDB:
     
     def get_lab_trends(self, patient_id: str, test_name: str) -> pd.DataFrame:
         """Get trend data for a specific lab test over time"""
-        labs = self.get_patient_labs(patient_id)
-        test_data = labs[labs["test_name"] == test_name.lower()].copy()
-        return test_data.sort_values("date")
+        # Labs are pre-sorted by (patient, test, date), so this is a contiguous slice
+        try:
+            test_data = self.labs.loc[[(patient_id, test_name.lower())], self._lab_columns]
+        except KeyError:
+            test_data = self.labs.iloc[:0][self._lab_columns]
+        return test_data.reset_index()
     
     def generate_health_summary(self, patient_id: str) -> Dict:
         """Generate comprehensive health summary for a patient"""
@@ -155,7 +221,7 @@ class HealthHistoryDB:
             "active_medications": meds["medication_name"].tolist() if not meds.empty else [],
             "abnormal_lab_count": len(abnormal_labs),
             "abnormal_tests": abnormal_labs["test_name"].unique().tolist() if not abnormal_labs.empty else [],
-            "latest_lab_date": self.labs[self.labs["patient_id"] == patient_id]["date"].max(),
+            "latest_lab_date": self._cached_patient_labs(patient_id)["date"].max(),
             "risk_factors": self._identify_risk_factors(patient_id)
         }
         
@@ -164,26 +230,11 @@ class HealthHistoryDB:
     def _identify_risk_factors(self, patient_id: str) -> List[str]:
         """Identify potential health risk factors based on data"""
         risks = []
-        abnormal = self.get_abnormal_labs(patient_id)
         
-        # Check for specific risk patterns
-        if not abnormal.empty:
-            tests = abnormal["test_name"].str.lower().unique()
-            
-            if any("cholesterol" in t or "ldl" in t for t in tests):
-                risks.append("Elevated cholesterol - cardiovascular risk")
-            
-            if any("glucose" in t or "a1c" in t for t in tests):
-                risks.append("Blood sugar abnormality - diabetes risk")
-            
-            if any("blood pressure" in t or "bp" in t for t in tests):
-                risks.append("Blood pressure concerns")
-            
-            if any("liver" in t or "alt" in t or "ast" in t for t in tests):
-                risks.append("Liver function monitoring needed")
-            
-            if any("kidney" in t or "creatinine" in t for t in tests):
-                risks.append("Kidney function monitoring needed")
+        # Look up flags precomputed at load
+        if patient_id in self._risk_matrix.index:
+            flags = self._risk_matrix.loc[patient_id]
+            risks = [risk for risk in RISK_PATTERNS if flags[risk]]
         
         if not risks:
             risks.append("No significant risk factors identified")
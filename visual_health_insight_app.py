@@ -1,14 +1,24 @@
 # Visual Health Insight App — Diagnostic + Medication Integration
 # -----------------------------------------------------
 # Run locally:
-#   pip install streamlit pandas numpy matplotlib python-dateutil
+#   pip install streamlit pandas numpy matplotlib python-dateutil lxml
 #   streamlit run visual_health_insight_app.py
 
 from __future__ import annotations
-import os, json, base64
+import os, json, re, html
 import pandas as pd
 import streamlit as st
-from xml.etree import ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from lxml import etree as ET
+
+SVG_NS = "http://www.w3.org/2000/svg"
+SVG_PATH = f"{{{SVG_NS}}}path"
+_TITLE_XPATH = ET.XPath(".//svg:title", namespaces={"svg": SVG_NS})
+
+# Paths that can be highlighted carry a data-hl="<n>" marker in the cached SVG text
+_HL_ATTRS = ("style", "fill", "fill-opacity", "stroke", "stroke-width")
+_HL_PATTERN = re.compile(r' data-hl="(\d+)"')
 
 # -----------------------------------------------------
 # Streamlit Setup
@@ -22,64 +32,158 @@ st.title("🩺 Visual Health Insight App — Diagnostic + Medication Mode")
 def file_exists(p):
     return os.path.exists(p) and os.path.getsize(p) > 0
 
+@st.cache_resource
 def load_json(p):
-    return json.load(open(p)) if file_exists(p) else None
-
-def set_fill(el, clr, opacity=1.0):
-    """Safely override fill color even if inline styles exist."""
-    style = el.attrib.get("style", "")
-    if "fill:" in style:
-        parts = [s for s in style.split(";") if not s.strip().startswith("fill:")]
-        el.set("style", ";".join(parts))
-    el.set("fill", clr)
-    el.set("fill-opacity", str(opacity))
-    el.set("stroke", "#000000")
-    el.set("stroke-width", "0.4")
-
-def state(val, lo, hi):
-    """Return test status."""
-    if val is None or pd.isna(val):
-        return "unknown"
-    if val < lo:
-        return "low"
-    if val > hi:
-        return "high"
-    return "normal"
+    if not file_exists(p):
+        return None
+    with open(p) as f:
+        return json.load(f)
+
+@st.cache_resource
+def load_text(p):
+    if not file_exists(p):
+        return ""
+    with open(p) as f:
+        return f.read()
+
+@st.cache_data
+def load_labs(p="patient_labs.csv"):
+    df = pd.read_csv(p, engine="pyarrow",
+                     dtype={"patient_id": "string", "test_name": "string", "unit": "string"},
+                     parse_dates=["test_date"])
+    df.rename(columns={"test_date": "date", "test_value": "value"}, inplace=True)
+    df["test_name"] = df["test_name"].str.strip().str.lower()
+    df["value"] = pd.to_numeric(df["value"], errors="coerce")
+    return df
+
+@st.cache_data
+def load_meds(p="patient_medications.csv"):
+    return pd.read_csv(p, engine="pyarrow",
+                       dtype={"patient_id": "string", "medication_name": "string"},
+                       parse_dates=["start_date"])
+
+def attr_text(attrs):
+    """Serialize an attribute dict as XML attribute text."""
+    return "".join(f' {k}="{html.escape(v, quote=True)}"' for k, v in attrs.items() if v is not None)
+
+def fill_attrs(style, clr, opacity=1.0):
+    """Attribute text that overrides fill color even if inline styles exist."""
+    if style and "fill:" in style:
+        style = ";".join(s for s in style.split(";") if not s.strip().startswith("fill:"))
+    return attr_text({
+        "style": style,
+        "fill": clr,
+        "fill-opacity": str(opacity),
+        "stroke": "#000000",
+        "stroke-width": "0.4",
+    })
+
+@st.cache_resource
+def build_system_indexes(body_map, med_db):
+    """Invert body_map so lab tests and medications map straight to systems."""
+    test_to_systems = {}
+    for sys_name, meta in body_map.items():
+        for t in meta.get("tests", []):
+            test_to_systems.setdefault(t.lower(), []).append(sys_name)
+
+    # A medication touches every system whose tests appear in its monitoring list
+    med_to_systems = {}
+    for mname, m_info in med_db.items():
+        systems = set()
+        for monitored in m_info.get("monitoring_required", []):
+            monitored_lower = monitored.lower()
+            for t, sys_names in test_to_systems.items():
+                if t in monitored_lower:
+                    systems.update(sys_names)
+        med_to_systems[mname] = frozenset(systems)
+    return test_to_systems, med_to_systems
+
+@st.cache_resource
+def build_system_ranges(body_map, ranges):
+    """One row per (test, system) pair with the test's reference range."""
+    ranges_lower = {k.lower(): v for k, v in ranges.items()}
+    rows = [
+        {"test_name": t.lower(), "system": sys_name,
+         "low": ranges_lower[t.lower()]["low"], "high": ranges_lower[t.lower()]["high"]}
+        for sys_name, meta in body_map.items()
+        for t in meta.get("tests", [])
+        if t.lower() in ranges_lower
+    ]
+    return pd.DataFrame(rows, columns=["test_name", "system", "low", "high"])
+
+@st.cache_resource
+def marked_svg(svg_text, svg_ids=()):
+    """Parse an SVG once, mark every path an svg_id can color, and serialize it.
+
+    Returns the marked SVG text, svg_id -> marker numbers, and each marked
+    path's original style/fill attributes keyed by marker number.
+    """
+    root = ET.fromstring(svg_text.encode())
+    titled = {}
+    seen = set()
+    for title in _TITLE_XPATH(root):
+        parent = title.getparent()
+        if parent in seen or not title.text:
+            continue
+        seen.add(parent)
+        titled.setdefault(title.text.strip().lower(), []).extend(parent.iter(SVG_PATH))
+
+    # An svg_id matches every title containing it (e.g. "bladder" -> "urinary bladder")
+    idx = {}
+    markers = {}
+    originals = {}
+    for sid in svg_ids:
+        sid_lower = sid.lower()
+        idx[sid_lower] = []
+        for text, paths in titled.items():
+            if sid_lower not in text:
+                continue
+            for el in paths:
+                if el not in markers:
+                    # Move the attributes a highlight overrides out of the tree
+                    n = markers[el] = len(markers)
+                    originals[n] = {k: el.attrib.pop(k, None) for k in _HL_ATTRS}
+                    el.set("data-hl", str(n))
+                idx[sid_lower].append(markers[el])
+    return ET.tostring(root, encoding="unicode"), idx, originals
 
 def highlight_svg(svg_text, affected_systems, med_systems, body_map):
     """Color affected and medicated systems using their default colors."""
+    svg_ids = tuple(sid for meta in body_map.values() for sid in meta.get("svg_ids", []))
     try:
-        root = ET.fromstring(svg_text)
+        marked, idx, originals = marked_svg(svg_text, svg_ids)
     except ET.ParseError:
         st.error("❌ SVG parse error.")
         return svg_text
 
-
+    colored = {}
     for sys_name, meta in body_map.items():
         if sys_name in affected_systems or sys_name in med_systems:
             clr = meta.get("color", "#ef5350")
             opacity = 1.0 if sys_name in affected_systems else 0.4
             for sid in meta.get("svg_ids", []):
-                sid_lower = sid.lower()
-                for el in root.findall(".//{*}*"):
-                    for child in el:
-                        if child.tag.endswith("title") and child.text:
-                            title_text = child.text.strip().lower()
-                            if sid_lower in title_text:
-                                for sub in el.findall(".//*"):
-                                    if sub.tag.endswith("path"):
-                                        set_fill(sub, clr, opacity)
-                                if el.tag.endswith("path"):
-                                    set_fill(el, clr, opacity)
-                    
-                                break
-    return ET.tostring(root, encoding="unicode")
+                for n in idx.get(sid.lower(), ()):
+                    colored[n] = fill_attrs(originals[n]["style"], clr, opacity)
+
+    # Swap each marker for highlight attributes, or the path's original ones
+    def restore(m):
+        n = int(m.group(1))
+        return colored[n] if n in colored else attr_text(originals[n])
+    return _HL_PATTERN.sub(restore, marked)
+
+SVG_FILES = {"male": "homo_sapiens_male.svg", "female": "homo_sapiens_female.svg"}
+
+@st.cache_data(show_spinner=False)
+def highlight_svg_cached(gender, affected, med):
+    """Colored SVG for a gender, cached on the sorted affected/medicated system tuples."""
+    body_map = load_json("body_system_mapping.json")
+    return highlight_svg(load_text(SVG_FILES[gender]), set(affected), set(med), body_map)
 
 def render_svg(svg_text, height=600):
     """Display SVG inline."""
-    b64 = base64.b64encode(svg_text.encode()).decode()
     st.components.v1.html(
-        f'<img src="data:image/svg+xml;base64,{b64}" height="{height}"/>',
+        f'<style>svg {{ height: 100%; width: auto; }}</style>'
+        f'<div style="height:{height}px">{svg_text}</div>',
         height=height + 40,
     )
 
@@ -102,20 +206,54 @@ if not ranges or not body_map or not med_db:
     st.stop()
 
 patients = patients_data["patients"]
-labs = pd.read_csv("patient_labs.csv")
-meds = pd.read_csv("patient_medications.csv")
-
-labs.rename(columns={"test_date": "date", "test_value": "value"}, inplace=True)
-labs["test_name"] = labs["test_name"].str.strip().str.lower()
-labs["value"] = pd.to_numeric(labs["value"], errors="coerce")
+system_ranges = build_system_ranges(body_map, ranges)
+_, med_to_systems = build_system_indexes(body_map, med_db)
+labs = load_labs()
+meds = load_meds()
 
-male_svg = open("homo_sapiens_male.svg").read() if file_exists("homo_sapiens_male.svg") else ""
-female_svg = open("homo_sapiens_female.svg").read() if file_exists("homo_sapiens_female.svg") else ""
+male_svg = load_text(SVG_FILES["male"])
+female_svg = load_text(SVG_FILES["female"])
 
 if not male_svg and not female_svg:
     st.error("❌ Missing SVG files.")
     st.stop()
 
+# -----------------------------------------------------
+# Prepare Patients (in parallel, no widgets)
+# -----------------------------------------------------
+def prepare_patient(pid, pinfo):
+    """Compute a patient's affected/medicated systems and colored SVG."""
+    # Filter this patient's data
+    labs_p = labs[labs["patient_id"] == pid].sort_values("date")
+    meds_p = meds[meds["patient_id"] == pid]
+
+    # 1️⃣ Identify affected systems from abnormal labs (latest value per test)
+    latest = labs_p.groupby("test_name", observed=True).tail(1).merge(system_ranges, on="test_name")
+    abnormal = (latest["value"] < latest["low"]) | (latest["value"] > latest["high"])
+    affected_systems = set(latest.loc[abnormal, "system"])
+
+    # 2️⃣ Identify medicated systems from medication monitoring
+    med_systems = set()
+    for mname in meds_p["medication_name"]:
+        med_systems |= med_to_systems.get(mname, frozenset())
+
+    # Remove overlap (labs already cover)
+    med_systems -= affected_systems
+
+    # Color the SVG for this gender, if one is available
+    gender = pinfo["general_info"]["gender"].lower()
+    colored_svg = None
+    if (gender == "female" and female_svg) or (gender == "male" and male_svg):
+        colored_svg = highlight_svg_cached(
+            gender, tuple(sorted(affected_systems)), tuple(sorted(med_systems))
+        )
+    return affected_systems, med_systems, colored_svg
+
+# Workers share this run's context so cached helpers work off the main thread
+with ThreadPoolExecutor(max_workers=os.cpu_count(), initializer=add_script_run_ctx,
+                        initargs=(None, get_script_run_ctx())) as ex:
+    prepared = list(ex.map(lambda kv: prepare_patient(*kv), patients.items()))
+
 # -----------------------------------------------------
 # Build Patient Tabs
 # -----------------------------------------------------
@@ -125,7 +263,7 @@ tabs = st.tabs(tab_titles)
 # -----------------------------------------------------
 # Render Each Patient
 # -----------------------------------------------------
-for (pid, pinfo), tab in zip(patients.items(), tabs):
+for (pid, pinfo), tab, (affected_systems, med_systems, colored_svg) in zip(patients.items(), tabs, prepared):
     with tab:
         st.subheader(f"🧍 {pinfo['name']} ({pid})")
         gi = pinfo["general_info"]
@@ -135,45 +273,6 @@ for (pid, pinfo), tab in zip(patients.items(), tabs):
         )
         st.divider()
 
-        # Filter this patient's data
-        labs_p = labs[labs["patient_id"] == pid].sort_values("date")
-        meds_p = meds[meds["patient_id"] == pid]
-
-        # 1️⃣ Identify affected systems from abnormal labs
-        affected_systems = set()
-        for sys_name, meta in body_map.items():
-            for t in meta.get("tests", []):
-                t_lower = t.lower()
-                df = labs_p[labs_p["test_name"] == t_lower]
-                if df.empty:
-                    continue
-                val = df["value"].iloc[-1]
-                key_match = next((k for k in ranges if k.lower() == t_lower), None)
-                if not key_match:
-                    continue
-                lo, hi = ranges[key_match]["low"], ranges[key_match]["high"]
-                s = state(val, lo, hi)
-                if s in ["high", "low"]:
-                    affected_systems.add(sys_name)
-
-        # 2️⃣ Identify medicated systems from medication monitoring
-        med_systems = set()
-        for _, mrow in meds_p.iterrows():
-            mname = mrow["medication_name"]
-            if mname not in med_db:
-                continue
-            m_info = med_db[mname]
-            for monitored in m_info.get("monitoring_required", []):
-                monitored_lower = monitored.lower()
-                for sys_name, meta in body_map.items():
-                    # If a monitored test belongs to this system
-                    for t in meta.get("tests", []):
-                        if t.lower() in monitored_lower:
-                            med_systems.add(sys_name)
-
-        # Remove overlap (labs already cover)
-        med_systems -= affected_systems
-
         # 3️⃣ Show summary
         if affected_systems:
             st.write("⚠️ **Abnormal systems detected:**", ", ".join(sorted(affected_systems)))
@@ -186,16 +285,10 @@ for (pid, pinfo), tab in zip(patients.items(), tabs):
         st.divider()
 
         # 4️⃣ Render SVG
-        gender = gi["gender"].lower()
-        if gender == "female" and female_svg:
-            svg = female_svg
-        elif gender == "male" and male_svg:
-            svg = male_svg
-        else:
+        if colored_svg is None:
             st.warning("⚠️ No SVG available for this gender.")
             continue
 
-        colored_svg = highlight_svg(svg, affected_systems, med_systems, body_map)
         render_svg(colored_svg)
 
         st.caption("Solid = abnormal system; translucent = monitored by medication.")